@@ -1,11 +1,21 @@
 import os
+import asyncio
 import logging
 import json
 import re
+import time
+import random
+from types import MappingProxyType
 from datetime import datetime
 from typing import Dict, List, Optional
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from curl_cffi import requests
+from curl_cffi.const import CurlHttpVersion
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -25,39 +35,97 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
+# httpx (dipakai python-telegram-bot) mencatat setiap polling di level INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+def _json_loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode()
+
+
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 1.0
+MAX_RETRY_DELAY = 8.0
+MAX_CONCURRENT_FETCHES = 8
+
+_TOKEN_RE = re.compile(r'__RequestVerificationToken.*?value="([^"]+)"')
+
+
+def _has_tz(v):
+    # "WIT" sudah mencakup "WITA"; upper() hanya bila teks bukan kapital
+    if "WIB" in v or "WIT" in v:
+        return True
+    vu = v.upper()
+    return "WIB" in vu or "WIT" in vu
+
+
+def _is_uuid(v):
+    return len(v) == 36 and v[8] == "-" and v[13] == "-" and v[18] == "-" and v[23] == "-"
+
+
+def _find_slot_keys(slot):
+    # Nama key SlotList tidak terdokumentasi: deteksi dari isinya
+    waktu_key = id_key = None
+    for k, v in slot.items():
+        if isinstance(v, str):
+            if _has_tz(v):
+                waktu_key = k
+            elif _is_uuid(v):
+                id_key = k
+    return waktu_key, id_key
+
 # =========================
 # CONFIG MANAGER
 # =========================
 class ConfigManager:
+    __slots__ = ('config_file', 'config')
+
+    PROVINCES_REF = MappingProxyType({
+        "11": "ACEH", "12": "SUMATERA UTARA", "13": "SUMATERA BARAT",
+        "31": "DKI JAKARTA", "32": "JAWA BARAT", "33": "JAWA TENGAH",
+        "34": "D.I. YOGYAKARTA", "35": "JAWA TIMUR", "36": "BANTEN",
+        "51": "BALI", "52": "NTB", "53": "NTT",
+        "61": "KALBAR", "62": "KALTENG", "63": "KALSEL",
+        "64": "KALTIM", "65": "KALTARA",
+        "71": "SULUT", "72": "SULTENG", "73": "SULSEL",
+        "74": "SULTRA", "75": "GORONTALO", "76": "SULBAR",
+        "81": "MALUKU", "82": "MALUT",
+        "91": "PAPUA BARAT", "94": "PAPUA"
+    })
+
     def __init__(self, config_file='config.json'):
         self.config_file = config_file
-        self.provinces_ref = {
-            "11": "ACEH", "12": "SUMATERA UTARA", "13": "SUMATERA BARAT",
-            "31": "DKI JAKARTA", "32": "JAWA BARAT", "33": "JAWA TENGAH",
-            "34": "D.I. YOGYAKARTA", "35": "JAWA TIMUR", "36": "BANTEN",
-            "51": "BALI", "52": "NTB", "53": "NTT",
-            "61": "KALBAR", "62": "KALTENG", "63": "KALSEL",
-            "64": "KALTIM", "65": "KALTARA",
-            "71": "SULUT", "72": "SULTENG", "73": "SULSEL",
-            "74": "SULTRA", "75": "GORONTALO", "76": "SULBAR",
-            "81": "MALUKU", "82": "MALUT",
-            "91": "PAPUA BARAT", "94": "PAPUA"
-        }
         self.config = self.load_config()
 
     def load_config(self):
         if os.path.exists(self.config_file):
-            with open(self.config_file, 'r') as f:
-                return json.load(f)
+            with open(self.config_file, 'rb') as f:
+                return _json_loads(f.read())
         default = {"province_id": 31}
         self.save_config(default)
         return default
 
     def save_config(self, config):
-        with open(self.config_file, 'w') as f:
-            json.dump(config, f, indent=4)
+        # Tulis ke file sementara lalu swap, agar config tidak pernah setengah jadi
+        tmp = self.config_file + ".tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(_json_dumps(config))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.config_file)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
         self.config = config
         return True
 
@@ -69,21 +137,28 @@ class ConfigManager:
         return self.save_config(self.config)
 
     def get_province_name(self, prov_id):
-        return self.provinces_ref.get(str(prov_id), f"PROV {prov_id}")
+        return self.PROVINCES_REF.get(str(prov_id), f"PROV {prov_id}")
 
 
 # =========================
 # BI SLOT EXTRACTOR
 # =========================
 class BISlotExtractor:
-    def __init__(self, province_id=31):
+    __slots__ = (
+        'base_url', 'list_url', 'api_url', 'province_id',
+        'token', 'cache_ttl', 'cache', 'session'
+    )
+
+    def __init__(self, province_id=31, cache_ttl=45.0):
         self.base_url = "https://pintar.bi.go.id"
         self.list_url = f"{self.base_url}/Order/ListKasKeliling?provinceId={province_id}"
         self.api_url = f"{self.base_url}/Order/GetKasKelByProvinceNew"
         self.province_id = province_id
         self.token = ""
+        self.cache_ttl = cache_ttl
+        self.cache = None  # (fetched_at, processed)
 
-        self.session = requests.Session()
+        self.session = requests.Session(http_version=CurlHttpVersion.V2_0)
         self.session.headers.update({
             "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
             "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
@@ -96,20 +171,17 @@ class BISlotExtractor:
     def refresh_token(self):
         try:
             r = self.session.get(self.list_url, impersonate="chrome124", timeout=30)
-            logger.info(f"[TOKEN] status={r.status_code}")
+            logger.debug("[TOKEN] status=%s http_version=%s", r.status_code, r.http_version)
 
             ct = r.headers.get("content-type", "")
-            logger.info(f"[TOKEN] content-type={ct}")
+            logger.debug("[TOKEN] content-type=%s", ct)
 
             snippet = (r.text or "")[:500].lower()
 
             if "waitingroom" in snippet or "captcha" in snippet or "cf" in snippet:
                 logger.warning("[TOKEN] Cloudflare / Waiting Room detected!")
 
-            token_match = re.search(
-                r'__RequestVerificationToken.*?value="([^"]+)"',
-                r.text
-            )
+            token_match = _TOKEN_RE.search(r.text)
 
             if token_match:
                 self.token = token_match.group(1)
@@ -121,16 +193,13 @@ class BISlotExtractor:
             return False
 
         except Exception as e:
-            logger.exception(f"[TOKEN ERROR] {e}")
+            logger.exception("[TOKEN ERROR] %s", e)
             return False
 
     # =========================
     # DATA
     # =========================
-    def get_all_data(self):
-        if not self.token and not self.refresh_token():
-            return []
-
+    def post_data(self):
         payload = {
             "draw": 1,
             "start": 0,
@@ -144,54 +213,104 @@ class BISlotExtractor:
             "referer": self.list_url
         }
 
-        try:
-            r = self.session.post(
-                self.api_url,
-                data=payload,
-                headers=headers,
-                impersonate="chrome124",
-                timeout=30
-            )
+        return self.session.post(
+            self.api_url,
+            data=payload,
+            headers=headers,
+            impersonate="chrome124",
+            timeout=30
+        )
+
+    @staticmethod
+    def _is_throttled(r):
+        if r.status_code in (429, 403):
+            return True
+        # Halaman Waiting Room berupa HTML; respons JSON tidak perlu di-decode
+        if "application/json" in r.headers.get("content-type", ""):
+            return False
+        return b"waitingroom" in r.content[:500].lower()
+
+    @staticmethod
+    def _retry_delay(r, attempt):
+        retry_after = r.headers.get("retry-after", "")
+        if retry_after.isdigit():
+            # Retry-After bisa sangat besar; jangan tahan semaphore/fetch terlalu lama
+            return min(float(retry_after), MAX_RETRY_DELAY)
+        return RETRY_BASE_DELAY * 2 ** attempt + random.uniform(0, 0.5)
 
-            logger.info(f"[DATA] status={r.status_code}")
+    def get_all_data(self):
+        if not self.token and not self.refresh_token():
+            return []
+
+        try:
+            token_refreshed = False
+            retries = 0
+            while True:
+                r = self.post_data()
+
+                # Token kadaluarsa: ambil ulang sekali, session tetap dipakai
+                if r.status_code in (401, 403) and not token_refreshed:
+                    logger.warning("[DATA] status=%s, refresh token", r.status_code)
+                    token_refreshed = True
+                    self.token = ""
+                    if not self.refresh_token():
+                        return []
+                    continue
+
+                if retries < MAX_RETRIES and self._is_throttled(r):
+                    delay = self._retry_delay(r, retries)
+                    retries += 1
+                    logger.warning("[DATA] status=%s, retry %d dalam %.1fs", r.status_code, retries, delay)
+                    time.sleep(delay)
+                    continue
+
+                break
+
+            logger.debug("[DATA] status=%s", r.status_code)
             ct = r.headers.get("content-type", "")
-            logger.info(f"[DATA] content-type={ct}")
+            logger.debug("[DATA] content-type=%s", ct)
 
             if "application/json" not in ct:
                 logger.warning("[DATA] Not JSON response ❌")
                 logger.warning(r.text[:300])
                 return []
 
-            result = r.json()
-            logger.info(f"[DATA] Keys: {list(result.keys())}")
+            result = _json_loads(r.content)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[DATA] Keys: %s", list(result.keys()))
 
             return result.get("data", [])
 
         except Exception as e:
-            logger.exception(f"[DATA ERROR] {e}")
+            logger.exception("[DATA ERROR] %s", e)
             return []
 
     # =========================
     # PROCESS
     # =========================
     def process_data(self):
+        now = time.monotonic()
+        if self.cache and now - self.cache[0] < self.cache_ttl:
+            return self.cache[1]
+
         raw = self.get_all_data()
         processed = []
+        waktu_key = id_key = None
 
         for item in raw:
             slots = []
             total = 0
 
             for s in item.get("SlotList", []):
-                waktu_text = "N/A"
-                waktu_id = "N/A"
-
-                for v in s.values():
-                    if isinstance(v, str):
-                        if any(t in v.upper() for t in ["WIB", "WITA", "WIT"]):
-                            waktu_text = v
-                        elif len(v) == 36 and "-" in v:
-                            waktu_id = v
+                # Skema stabil: key dicari sekali, slot berikutnya dibaca langsung.
+                # Nilai yang tidak valid (slot kosong/batal, key bergeser) di-scan ulang.
+                waktu_text = s.get(waktu_key) if waktu_key else None
+                waktu_id = s.get(id_key) if id_key else None
+                if not (isinstance(waktu_text, str) and _has_tz(waktu_text)
+                        and isinstance(waktu_id, str) and _is_uuid(waktu_id)):
+                    waktu_key, id_key = _find_slot_keys(s)
+                    waktu_text = s[waktu_key] if waktu_key else "N/A"
+                    waktu_id = s[id_key] if id_key else "N/A"
 
                 sisa = s.get("SisaQuota", 0)
                 total += sisa
@@ -212,55 +331,108 @@ class BISlotExtractor:
                     "slots": slots
                 })
 
+        # Jangan cache hasil kosong (bisa jadi diblok), biar dicoba lagi
+        self.cache = (now, processed) if processed else None
         return processed
 
 
+# =========================
+# SHARED STATE
+# =========================
+CONFIG = ConfigManager()
+EXTRACTORS: Dict[int, BISlotExtractor] = {}
+
+
+def get_extractor(prov_id) -> BISlotExtractor:
+    extractor = EXTRACTORS.get(prov_id)
+    if extractor is None:
+        extractor = BISlotExtractor(prov_id)
+        EXTRACTORS[prov_id] = extractor
+    return extractor
+
+
 # =========================
 # BOT LOGIC
 # =========================
+_START_TEXT = (
+    "👋 *BI Slot Monitor*\n\n"
+    "📍 Wilayah: `{prov_name}`\n\n"
+    "Ketik ID provinsi untuk ganti.\n"
+    "Tekan tombol di bawah:"
+)
+
+_MAIN_MENU_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📊 Detail Slot", callback_data="slot")],
+    [InlineKeyboardButton("📋 Ringkasan", callback_data="ringkasan")]
+])
+
+
 class BISlotBot:
+    __slots__ = ('_render_cache', '_fetch_sem', '_inflight')
+
     def __init__(self):
-        self.config = ConfigManager()
+        self._render_cache: Dict[int, tuple] = {}  # prov_id -> (data, text)
+        self._fetch_sem = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+        self._inflight: Dict[int, asyncio.Task] = {}
+
+    async def _fetch_upstream(self, prov_id):
+        async with self._fetch_sem:
+            return await asyncio.to_thread(get_extractor(prov_id).process_data)
+
+    async def _fetch(self, prov_id):
+        # Tap beruntun untuk provinsi yang sama menunggu fetch yang sedang jalan
+        task = self._inflight.get(prov_id)
+        if task is None:
+            task = asyncio.create_task(self._fetch_upstream(prov_id))
+            self._inflight[prov_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(prov_id, None))
+        return await asyncio.shield(task)
+
+    def _render_detail(self, prov_id, data) -> str:
+        # process_data() mengembalikan list yang sama selama cache masih berlaku
+        hit = self._render_cache.get(prov_id)
+        if hit and hit[0] is data:
+            return hit[1]
+
+        parts = ["📊 *DETAIL SLOT*\n\n"]
+        for item in data:
+            parts.append(
+                f"📍 *{item['lokasi']}*\n"
+                f"📅 {item['tanggal']}\n"
+                f"Total: {item['total']}\n\n"
+            )
+        result = "".join(parts)
 
-    async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        prov_id = self.config.get_province_id()
-        prov_name = self.config.get_province_name(prov_id)
-
-        text = (
-            "👋 *BI Slot Monitor*\n\n"
-            f"📍 Wilayah: `{prov_name}`\n\n"
-            "Ketik ID provinsi untuk ganti.\n"
-            "Tekan tombol di bawah:"
-        )
+        self._render_cache[prov_id] = (data, result)
+        return result
+
+    async def warm_up(self, application):
+        # Ambil token di awal agar tap pertama cukup 1 request (POST saja)
+        prov_id = CONFIG.get_province_id()
+        await asyncio.to_thread(get_extractor(prov_id).refresh_token)
 
-        kb = InlineKeyboardMarkup([
-            [InlineKeyboardButton("📊 Detail Slot", callback_data="slot")],
-            [InlineKeyboardButton("📋 Ringkasan", callback_data="ringkasan")]
-        ])
+    async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        prov_id = CONFIG.get_province_id()
+        prov_name = CONFIG.get_province_name(prov_id)
 
-        await update.message.reply_text(text, parse_mode="Markdown", reply_markup=kb)
+        text = _START_TEXT.format(prov_name=prov_name)
+        await update.message.reply_text(text, parse_mode="Markdown", reply_markup=_MAIN_MENU_KB)
 
     async def show_slot(self, update, context):
         query = update.callback_query
         await query.answer()
 
-        await query.message.reply_text("🔍 Mengambil data...")
+        status = await query.message.reply_text("🔍 Mengambil data...")
 
-        prov_id = self.config.get_province_id()
-        extractor = BISlotExtractor(prov_id)
-        data = extractor.process_data()
+        prov_id = CONFIG.get_province_id()
+        data = await self._fetch(prov_id)
 
         if not data:
-            await query.message.reply_text("❌ Data kosong / kemungkinan diblok server.")
+            await status.edit_text("❌ Data kosong / kemungkinan diblok server.")
             return
 
-        result = f"📊 *DETAIL SLOT*\n\n"
-        for item in data:
-            result += f"📍 *{item['lokasi']}*\n"
-            result += f"📅 {item['tanggal']}\n"
-            result += f"Total: {item['total']}\n\n"
-
-        await query.message.reply_text(result, parse_mode="Markdown")
+        result = self._render_detail(prov_id, data)
+        await status.edit_text(result, parse_mode="Markdown")
 
     async def callback_handler(self, update, context):
         query = update.callback_query
@@ -280,7 +452,12 @@ if __name__ == "__main__":
         keep_alive()
 
         bot_logic = BISlotBot()
-        app = Application.builder().token(BOT_TOKEN).build()
+        app = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .post_init(bot_logic.warm_up)
+            .build()
+        )
 
         app.add_handler(CommandHandler("start", bot_logic.start))
         app.add_handler(CallbackQueryHandler(bot_logic.callback_handler))